@@ -14,20 +14,30 @@
 # ==============================================================================
 """Library to process data for tagging task such as NER/POS."""
 import collections
+import functools
 import os
 
 from absl import logging
 import tensorflow as tf
 import json
 from official.nlp.data import classifier_data_lib
-import pdb
 import numpy as np
-from itertools import groupby
-import statistics
-
-from math import sqrt
 import multiprocessing as mp
 # from joblib import Parallel, delayed
+
+# Numba is optional: when present the max-context kernel is JIT-compiled,
+# otherwise the vectorized NumPy path is used.
+try:
+  from numba import njit
+except ImportError:
+  njit = None
+
+# orjson is optional: several times faster than the stdlib json module and
+# parses bytes directly, used for reading the jsonl inputs when available.
+try:
+  import orjson
+except ImportError:
+  orjson = None
 # A negative label id for the padding label, which will not contribute
 # to loss/metrics in training.
 _PADDING_LABEL_ID = -1
@@ -40,12 +50,22 @@ _UNK_TOKEN = "[UNK]"
 class InputExample(object):
   """A single training/test example for token classification."""
 
-  def __init__(self, sentence_id, words=None, label_ids=None, best_context=None):
+  # Millions of these are alive at once (every sentence plus every split
+  # sub-example); slots drop the per-instance dict and make attribute access
+  # a fixed-offset lookup.
+  __slots__ = ("sentence_id", "words", "label_ids", "best_context",
+               "input_ids")
+
+  def __init__(self, sentence_id, words=None, label_ids=None,
+               best_context=None, input_ids=None):
     """Constructs an InputExample."""
     self.sentence_id = sentence_id
     self.words = words if words else []
     self.label_ids = label_ids if label_ids else []
     self.best_context = best_context if best_context else []
+    # Subword ids precomputed for `words`; None means they still need a
+    # vocab lookup in _convert_single_example.
+    self.input_ids = input_ids
 
   def add_word_and_label_id(self, word, label_id, best_context=None):
     """Adds word and label_id pair in the example."""
@@ -57,13 +77,19 @@ class InputExample(object):
 
 def _read_one_file(file_name, label_list):
   """Reads one file and returns a list of `InputExample` instances."""
-  lines = tf.io.gfile.GFile(file_name, "r").readlines()
+  if file_name.startswith(("gs://", "hdfs://", "s3://")):
+    with tf.io.gfile.GFile(file_name, "r") as f:
+      lines = f.read().splitlines()
+  else:
+    # Plain buffered I/O beats gfile's per-line Python/C++ crossings by a
+    # wide margin for local files; one read + splitlines avoids both.
+    with open(file_name, "r", buffering=1 << 20) as f:
+      lines = f.read().splitlines()
   examples = []
   label_id_map = {label: i for i, label in enumerate(label_list)}
   sentence_id = 0
   example = InputExample(sentence_id=0)
   for line in lines:
-    line = line.strip("\n")
     if line:
       # The format is: <token>\t<label> for train/dev set and <token> for test.
       items = line.split("\t")
@@ -200,25 +226,59 @@ class TsTypeProcessor(classifier_data_lib.DataProcessor):
   def get_processor_name():
     return "ts_type"
 
+# Tokenizer backing the LRU-cached word tokenization below. Corpora are
+# Zipf-distributed, so most tokenize() calls repeat a small set of words.
+_cache_tokenizer = None
+
+
+@functools.lru_cache(maxsize=200_000)
+def _tokenize_word_cached(word):
+  return tuple(_cache_tokenizer.tokenize(word))
+
+
+def _set_cache_tokenizer(tokenizer):
+  """Points the word-tokenization cache at `tokenizer`, dropping stale hits."""
+  global _cache_tokenizer
+  if tokenizer is not _cache_tokenizer:
+    _cache_tokenizer = tokenizer
+    _tokenize_word_cached.cache_clear()
+
+
+def _cached_tokenize(tokenizer, word):
+  """Tokenizes `word`, using the LRU cache when it backs this tokenizer."""
+  if tokenizer is _cache_tokenizer:
+    return list(_tokenize_word_cached(word))
+  return tokenizer.tokenize(word)
+
+
+def _has_real_label(label_ids):
+  """Returns True if any label is not the padding label (short-circuits)."""
+  return any(label_id != _PADDING_LABEL_ID for label_id in label_ids)
+
+
 def _tokenize_example(example, max_length, tokenizer, text_preprocessing=None, use_neg_labels=True, doc_stride=None):
   """Tokenizes words and breaks long example into short ones."""
   # Needs additional [CLS] and [SEP] tokens.
   max_length = max_length - 2
   new_examples = []
   new_example = InputExample(sentence_id=example.sentence_id)
-  for i, word in enumerate(example.words):
+  # Preprocess the whole word list up front instead of once per iteration of
+  # the subword loop below.
+  if text_preprocessing:
+    words = [text_preprocessing(word) for word in example.words]
+  else:
+    words = example.words
+  for i, word in enumerate(words):
     if not use_neg_labels and any([x < 0 for x in example.label_ids]):
       raise ValueError("Unexpected negative label_id: %s" % example.label_ids)
 
-    if text_preprocessing:
-      word = text_preprocessing(word)
-    subwords = tokenizer.tokenize(word)
+    subwords = _cached_tokenize(tokenizer, word)
     if (not subwords or len(subwords) > max_length) and word:
       subwords = [_UNK_TOKEN]
 
     if len(subwords) + len(new_example.words) > max_length:
       # Start a new example. Only add if there is a label that is not all -1
-      if new_example.label_ids.count(_PADDING_LABEL_ID) != len(new_example.label_ids) and new_example.label_ids:
+      if _has_real_label(new_example.label_ids):
         new_examples.append(new_example)
       new_example = InputExample(sentence_id=example.sentence_id)
 
@@ -229,38 +289,53 @@ def _tokenize_example(example, max_length, tokenizer, text_preprocessing=None, u
       best_context = 1 if subword_label!=_PADDING_LABEL_ID else 0
       new_example.add_word_and_label_id(subword, subword_label, best_context)
 
-  if new_example.words and new_example.label_ids.count(_PADDING_LABEL_ID) != len(new_example.label_ids) and new_example.label_ids:
+  if new_example.words and _has_real_label(new_example.label_ids):
     new_examples.append(new_example)
 
   return new_examples
 
 
-def _convert_single_example(example, max_seq_length, tokenizer):
-  """Converts an `InputExample` instance to a `tf.train.Example` instance."""
-  tokens = ["[CLS]"]
-  tokens.extend(example.words)
-  tokens.append("[SEP]")
-  input_ids = tokenizer.convert_tokens_to_ids(tokens)
-  label_ids = [_PADDING_LABEL_ID]
-  label_ids.extend(example.label_ids)
-  label_ids.append(_PADDING_LABEL_ID)
+# Cached [CLS]/[SEP] ids per tokenizer; they are constants for a given vocab,
+# so look them up once instead of per emitted example.
+_special_token_ids = {}
 
-  context = [False]+example.best_context+[False]
 
-  segment_ids = [0] * len(input_ids)
-  input_mask = [1] * len(input_ids)
+def _get_special_token_ids(tokenizer):
+  key = id(tokenizer)
+  ids = _special_token_ids.get(key)
+  if ids is None:
+    ids = tuple(tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"]))
+    _special_token_ids[key] = ids
+  return ids
 
-  # Pad up to the sequence length.
-  while len(input_ids) < max_seq_length:
-    input_ids.append(0)
-    input_mask.append(0)
-    segment_ids.append(0)
-    label_ids.append(_PADDING_LABEL_ID)
-    context.append(0)
 
+def _convert_single_example(example, max_seq_length, tokenizer):
+  """Converts an `InputExample` instance to a `tf.train.Example` instance."""
+  num_tokens = len(example.words) + 2
+
+  # Preallocate padded int64 arrays and fill the prefix with one slice
+  # assignment per field instead of appending one position at a time.
+  input_ids = np.zeros(max_seq_length, dtype=np.int64)
+  cls_id, sep_id = _get_special_token_ids(tokenizer)
+  input_ids[0] = cls_id
+  if example.input_ids is not None:
+    # The document's subword ids were computed once up front.
+    input_ids[1:num_tokens - 1] = example.input_ids
+  else:
+    input_ids[1:num_tokens - 1] = tokenizer.convert_tokens_to_ids(
+        example.words)
+  input_ids[num_tokens - 1] = sep_id
+  input_mask = np.zeros(max_seq_length, dtype=np.int64)
+  input_mask[:num_tokens] = 1
+  segment_ids = np.zeros(max_seq_length, dtype=np.int64)
+  label_ids = np.full(max_seq_length, _PADDING_LABEL_ID, dtype=np.int64)
+  label_ids[1:num_tokens - 1] = example.label_ids
+  context = np.zeros(max_seq_length, dtype=np.int64)
+  context[1:num_tokens - 1] = example.best_context
 
   def create_int_feature(values):
-    return tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
+    # Int64List accepts array-likes directly; no boxing into a Python list.
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
 
   features = collections.OrderedDict()
   features["input_ids"] = create_int_feature(input_ids)
@@ -273,43 +348,140 @@ def _convert_single_example(example, max_seq_length, tokenizer):
   tf_example = tf.train.Example(features=tf.train.Features(feature=features))
   return tf_example
 
-def _check_is_max_context(doc_spans, cur_span_index, position):
-  """Check if this is the 'max context' doc span for the token."""
+if njit is not None:
 
-  # Because of the sliding window approach taken to scoring documents, a single
-  # token can appear in multiple documents. E.g.
-  #  Doc: the man went to the store and bought a gallon of milk
-  #  Span A: the man went to the
-  #  Span B: to the store and bought
-  #  Span C: and bought a gallon of
-  #  ...
-  #
-  # Now the word 'bought' will have two scores from spans B and C. We only
-  # want to consider the score with "maximum context", which we define as
-  # the *minimum* of its left and right context (the *sum* of left and
-  # right context will always be the same, of course).
-  #
-  # In the example the maximum context for 'bought' would be span C since
-  # it has 1 left context and 3 right context, while span B has 4 left context
-  # and 0 right context.
-  best_score = None
-  best_span_index = None
+  @njit(cache=True, fastmath=True)
+  def _best_span_idx(starts, lengths, position):
+    """Returns the index of the 'max context' span for `position`, or -1."""
+    best_score = -1.0
+    best_span_index = -1
+    for span_index in range(starts.shape[0]):
+      end = starts[span_index] + lengths[span_index] - 1
+      if position < starts[span_index] or position > end:
+        continue
+      num_left_context = position - starts[span_index]
+      num_right_context = end - position
+      score = (min(num_left_context, num_right_context) +
+               0.01 * lengths[span_index])
+      if best_span_index == -1 or score > best_score:
+        best_score = score
+        best_span_index = span_index
+    return best_span_index
+
+  # Pre-warm the JIT so the first real document does not pay compile cost.
+  _best_span_idx(
+      np.zeros(1, dtype=np.int32), np.ones(1, dtype=np.int32), 0)
+else:
+  _best_span_idx = None
+
+
+def _build_doc_spans_impl(n_tokens, max_tokens_for_doc, doc_stride, label_arr):
+  """Enumerates sliding-window spans that contain at least one label.
+
+  Pure integer arithmetic over preallocated arrays so it can be JIT-compiled
+  by Numba when available.
+
+  Args:
+    n_tokens: Number of subword tokens in the document.
+    max_tokens_for_doc: Maximum tokens per span.
+    doc_stride: Stride between consecutive span starts.
+    label_arr: Sorted int64 array of label token positions.
+
+  Returns:
+    A (starts, lengths, label_lo, label_hi) tuple of arrays; span i covers
+    [starts[i], starts[i] + lengths[i]) and its labels are the CSR-style
+    slice label_arr[label_lo[i]:label_hi[i]].
+  """
+  step = min(max_tokens_for_doc, doc_stride)
+  max_spans = n_tokens // step + 2
+  starts = np.empty(max_spans, dtype=np.int32)
+  lengths = np.empty(max_spans, dtype=np.int32)
+  label_lo = np.empty(max_spans, dtype=np.int64)
+  label_hi = np.empty(max_spans, dtype=np.int64)
+  count = 0
+
+  start_offset = 0
+  while start_offset < n_tokens:
+    length = n_tokens - start_offset
+    if length > max_tokens_for_doc:
+      length = max_tokens_for_doc
+    lo = np.searchsorted(label_arr, start_offset)
+    hi = np.searchsorted(label_arr, start_offset + length)
+    if hi > lo:
+      starts[count] = start_offset
+      lengths[count] = length
+      label_lo[count] = lo
+      label_hi[count] = hi
+      count += 1
+    if start_offset + length == n_tokens:
+      break
+    start_offset += min(length, doc_stride)
 
-  for (span_index, doc_span) in enumerate(doc_spans):
-    end = doc_span.start + doc_span.length - 1
-    if position < doc_span.start:
-      continue
-    if position > end:
-      continue
+  return starts[:count], lengths[:count], label_lo[:count], label_hi[:count]
 
-    num_left_context = position - doc_span.start
-    num_right_context = end - position
-    score = min(num_left_context, num_right_context) + 0.01 * doc_span.length
-    if best_score is None or score > best_score:
-      best_score = score
-      best_span_index = span_index
 
-  return cur_span_index == best_span_index
+if njit is not None:
+  _build_doc_spans = njit(cache=True)(_build_doc_spans_impl)
+  # Pre-warm the JIT alongside the scoring kernel.
+  _build_doc_spans(1, 1, 1, np.zeros(0, dtype=np.int64))
+else:
+  _build_doc_spans = _build_doc_spans_impl
+
+
+def _find_max_context_spans(starts, lengths, positions):
+  """Finds the 'max context' doc span for every label position.
+
+  Because of the sliding window approach taken to scoring documents, a single
+  token can appear in multiple documents. E.g.
+   Doc: the man went to the store and bought a gallon of milk
+   Span A: the man went to the
+   Span B: to the store and bought
+   Span C: and bought a gallon of
+   ...
+
+  Now the word 'bought' will have two scores from spans B and C. We only
+  want to consider the score with "maximum context", which we define as
+  the *minimum* of its left and right context (the *sum* of left and
+  right context will always be the same, of course).
+
+  In the example the maximum context for 'bought' would be span C since
+  it has 1 left context and 3 right context, while span B has 4 left context
+  and 0 right context.
+
+  Scores all (position, span) pairs in one vectorized NumPy computation
+  instead of rescanning the spans per position.
+
+  Args:
+    starts: A 1-D int array with the start offset of every doc span.
+    lengths: A 1-D int array with the length of every doc span.
+    positions: A 1-D int array of label token positions.
+
+  Returns:
+    A 1-D int array with the best span index per position, -1 for positions
+    not covered by any span.
+  """
+  if _best_span_idx is not None:
+    starts32 = np.ascontiguousarray(starts, dtype=np.int32)
+    lengths32 = np.ascontiguousarray(lengths, dtype=np.int32)
+    best = np.empty(len(positions), dtype=np.int64)
+    for row, position in enumerate(positions):
+      best[row] = _best_span_idx(starts32, lengths32, position)
+    return best
+
+  starts = np.asarray(starts, dtype=np.int64)
+  lengths = np.asarray(lengths, dtype=np.int64)
+  ends = starts + lengths - 1
+
+  num_left_context = positions[:, None] - starts[None, :]
+  num_right_context = ends[None, :] - positions[:, None]
+  scores = (np.minimum(num_left_context, num_right_context) +
+            0.01 * lengths[None, :])
+  invalid = (num_left_context < 0) | (num_right_context < 0)
+  scores[invalid] = -np.inf
+
+  best = scores.argmax(axis=1)
+  best[invalid.all(axis=1)] = -1
+  return best
 
 
 def convert_examples_to_features(example, tokenizer, max_seq_length, doc_stride, is_training=False):
@@ -326,21 +498,49 @@ def convert_examples_to_features(example, tokenizer, max_seq_length, doc_stride,
 
   # from time import time
   # st = time()
-  for i, (token, label) in enumerate(zip(example.words, example.label_ids)):
-
-    sub_tokens = tokenizer.tokenize(token)
-
-    if not sub_tokens and token:
-      sub_tokens = [_UNK_TOKEN]
-
-    for sub_token in sub_tokens:
-      all_doc_tokens.append(sub_token)
-
-    for j, sub_token in enumerate(sub_tokens):
-      sublabel = label if j == 0 else _PADDING_LABEL_ID
-      if sublabel!=_PADDING_LABEL_ID:
-          example_label_ix.append(len(all_doc_labels))
-      all_doc_labels.append(sublabel)
+  use_fast = getattr(tokenizer, "is_fast", False)
+  if use_fast:
+    # HF fast tokenizers run the whole word list through the Rust backend in
+    # one call instead of one Python->Rust crossing per word; word_ids() gives
+    # the subword->word alignment needed to place the labels.
+    enc = tokenizer(
+        example.words, is_split_into_words=True, add_special_tokens=False)
+    word_ids = enc.word_ids()
+    # A word the normalizer strips to zero subwords vanishes from word_ids
+    # and would silently lose its label; the per-word loop substitutes
+    # [UNK] for it instead, so fall back to keep both paths identical.
+    if len(set(word_ids)) != len(example.words):
+      use_fast = False
+  if use_fast:
+    all_doc_tokens = list(enc.tokens())
+    if word_ids:
+      wids = np.asarray(word_ids)
+      first_sub = np.concatenate(([True], wids[1:] != wids[:-1]))
+      sub_labels = np.full(len(wids), _PADDING_LABEL_ID, dtype=np.int64)
+      sub_labels[first_sub] = np.asarray(
+          example.label_ids, dtype=np.int64)[wids[first_sub]]
+      all_doc_labels = sub_labels.tolist()
+      example_label_ix = np.flatnonzero(
+          sub_labels != _PADDING_LABEL_ID).tolist()
+    all_doc_ids = np.asarray(enc["input_ids"], dtype=np.int64)
+  else:
+    for i, (token, label) in enumerate(zip(example.words, example.label_ids)):
+
+      sub_tokens = _cached_tokenize(tokenizer, token)
+
+      if not sub_tokens and token:
+        sub_tokens = [_UNK_TOKEN]
+
+      for j, sub_token in enumerate(sub_tokens):
+        all_doc_tokens.append(sub_token)
+        sublabel = label if j == 0 else _PADDING_LABEL_ID
+        if sublabel!=_PADDING_LABEL_ID:
+            example_label_ix.append(len(all_doc_labels))
+        all_doc_labels.append(sublabel)
+    # Convert the document's subwords to ids once; each emitted span slices
+    # this array instead of re-running the vocab lookup per span.
+    all_doc_ids = np.asarray(
+        tokenizer.convert_tokens_to_ids(all_doc_tokens), dtype=np.int64)
 
   # The -2 accounts for [CLS], [SEP]
   max_tokens_for_doc = max_seq_length - 2
@@ -348,26 +548,20 @@ def convert_examples_to_features(example, tokenizer, max_seq_length, doc_stride,
   # We can have documents that are longer than the maximum sequence length.
   # To deal with this we do a sliding window approach, where we take chunks
   # of the up to our max length with a stride of `doc_stride`.
-  _DocSpan = collections.namedtuple(  # pylint: disable=invalid-name
-      "DocSpan", ["start", "length", "labels", "best_context"])
-  doc_spans = []
-
-  start_offset = 0
+  # Spans are kept in structure-of-arrays layout (parallel start/length
+  # arrays plus one best_context row per span) so the max-context scoring
+  # can index them as flat NumPy arrays.
+  # Label positions are appended in order, so label_arr is sorted and the
+  # labels inside a span are just a binary-searched slice of it.
+  label_arr = np.asarray(example_label_ix, dtype=np.int64)
 
   #create all the doc spans for the document
-  while start_offset < len(all_doc_tokens):
-    length = len(all_doc_tokens) - start_offset
-    if length > max_tokens_for_doc:
-      length = max_tokens_for_doc
-    mask = [True if ix >=start_offset and ix<(start_offset+length) else False for ix in example_label_ix]
-    in_span = any(mask)
-    span_labels = tuple(np.array(example_label_ix)[mask].tolist())
-
-    if in_span:
-      doc_spans.append(_DocSpan(start=start_offset, length=length, labels=span_labels, best_context=[False]*length)) #is this a problem
-    if start_offset + length == len(all_doc_tokens):
-      break
-    start_offset += min(length, doc_stride)
+  spans_start, spans_length, spans_label_lo, spans_label_hi = _build_doc_spans(
+      len(all_doc_tokens), max_tokens_for_doc, doc_stride, label_arr)
+  # One bool row per span; the last span may be shorter than the row, so rows
+  # are sliced to the span length on emission.
+  spans_best_context = np.zeros((len(spans_start), max_tokens_for_doc),
+                                dtype=np.bool_)
 
   #remove any subset examples i.e DocSpan(start=6218, length=126, labels=(6256, 6281, 6311)) and
   # DocSpan(start=6248, length=126, labels=(6256, 6281, 6311, 6359, 6363))
@@ -384,43 +578,30 @@ def convert_examples_to_features(example, tokenizer, max_seq_length, doc_stride,
   #     del doc_spans[index]
 
 
-  # optimal_span_list = []
-  # for v in example_label_ix:  # start adding the context from document
-  #   for (doc_span_index, doc_span) in enumerate(doc_spans):
-  #
-  #     if v < doc_span.start or v >= doc_span.start+ doc_span.length:
-  #       continue
-  #     # split_token_index = doc_span.start + i
-  #     is_max_context = _check_is_max_context(doc_spans, doc_span_index,
-  #                                            v)
-  #
-  #     if is_max_context:
-  #       doc_span.best_context[v-doc_span.start] = 1
-  #       optimal_span_list.append(doc_span)
-
-  optimal_span_list = []
+  optimal_span_indices = []
 
-  for (doc_span_index, doc_span) in enumerate(doc_spans):
-    has_is_max_context = False
-    for v in example_label_ix:  # start adding the context from document
-      if v < doc_span.start or v >= doc_span.start+ doc_span.length:
+  if len(spans_start) and example_label_ix:
+    positions = np.asarray(example_label_ix, dtype=np.int64)
+    best_span_indices = _find_max_context_spans(spans_start, spans_length,
+                                                positions)
+    seen_span_indices = set()
+    for position, span_index in zip(positions, best_span_indices):
+      if span_index < 0:
         continue
-      # split_token_index = doc_span.start + i
-      is_max_context = _check_is_max_context(doc_spans, doc_span_index,
-                                             v)
+      spans_best_context[span_index, position - spans_start[span_index]] = True
+      seen_span_indices.add(int(span_index))
+    optimal_span_indices = sorted(seen_span_indices)
 
-      if is_max_context:
-        has_is_max_context = True
-        doc_span.best_context[v-doc_span.start] = True
-    if has_is_max_context:
-      optimal_span_list.append(doc_span)
 
-
-  for span in optimal_span_list:
-    tokens = all_doc_tokens[span.start:span.start + span.length]
-    labels = all_doc_labels[span.start:span.start + span.length]
+  for span_index in optimal_span_indices:
+    start = int(spans_start[span_index])
+    length = int(spans_length[span_index])
+    tokens = all_doc_tokens[start:start + length]
+    labels = all_doc_labels[start:start + length]
     all_examples.append(
-      InputExample(example.sentence_id, words=tokens, label_ids=labels, best_context=span.best_context))
+      InputExample(example.sentence_id, words=tokens, label_ids=labels,
+                   best_context=spans_best_context[span_index, :length].tolist(),
+                   input_ids=all_doc_ids[start:start + length]))
 
   # # for eval
   # is_training=False
@@ -482,12 +663,77 @@ def convert_examples_to_features(example, tokenizer, max_seq_length, doc_stride,
 
 
 
+# Per-process conversion parameters, populated by `_init_worker` so that pool
+# workers do not re-pickle the tokenizer for every example.
+_worker_tokenizer = None
+_worker_max_seq_length = None
+_worker_doc_stride = None
+_worker_text_preprocessing = None
+_worker_is_training = False
+
+
+def _init_worker(tokenizer, max_seq_length, doc_stride, text_preprocessing,
+                 is_training):
+  """Stores the conversion parameters in the worker process globals."""
+  global _worker_tokenizer, _worker_max_seq_length, _worker_doc_stride
+  global _worker_text_preprocessing, _worker_is_training
+  _set_cache_tokenizer(tokenizer)
+  _worker_tokenizer = tokenizer
+  _worker_max_seq_length = max_seq_length
+  _worker_doc_stride = doc_stride
+  _worker_text_preprocessing = text_preprocessing
+  _worker_is_training = is_training
+
+
+def _perform_convert_to_features(example, tokenizer, max_seq_length,
+                                 doc_stride, text_preprocessing, is_training):
+  """Converts one `InputExample` into a list of `tf.train.Example`s."""
+  if doc_stride:
+    tokenized_examples = convert_examples_to_features(
+        example, tokenizer=tokenizer, max_seq_length=max_seq_length,
+        doc_stride=doc_stride, is_training=is_training)
+  else:
+    tokenized_examples = _tokenize_example(
+        example, max_seq_length, tokenizer, text_preprocessing,
+        doc_stride=None)
+
+  tf_examples = []
+  for per_tokenized_example in tokenized_examples:
+    tf_example = _convert_single_example(per_tokenized_example,
+                                         max_seq_length, tokenizer)
+    tf_examples.append(tf_example)
+  return tf_examples
+
+
+def _worker_convert(example):
+  """Converts one example in a pool worker, returning serialized protos."""
+  tf_examples = _perform_convert_to_features(
+      example, _worker_tokenizer, _worker_max_seq_length, _worker_doc_stride,
+      _worker_text_preprocessing, _worker_is_training)
+  # Serialize in the worker so protobuf objects are never pickled back.
+  return [tf_example.SerializeToString() for tf_example in tf_examples]
+
+
+def _write_shard(shard_args):
+  """Converts and writes one output shard's examples in a pool worker."""
+  shard_path, shard_examples = shard_args
+  writer = tf.io.TFRecordWriter(shard_path)
+  count = 0
+  for example in shard_examples:
+    for serialized_example in _worker_convert(example):
+      writer.write(serialized_example)
+      count += 1
+  writer.close()
+  return count
+
+
 def write_example_to_file(examples,
                           tokenizer,
                           max_seq_length,
                           output_file,
                           text_preprocessing=None,
-                          doc_stride=None, is_training=False):
+                          doc_stride=None, is_training=False,
+                          num_shards=1):
   """Writes `InputExample`s into a tfrecord file with `tf.train.Example` protos.
 
   Note that the words inside each example will be tokenized and be applied by
@@ -530,51 +776,62 @@ def write_example_to_file(examples,
     output_file: The name of the output tfrecord file.
     text_preprocessing: optional preprocessing run on each word prior to
       tokenization.
+    num_shards: Number of output shards; `None` means one per core. With
+      more than one shard, each pool worker owns one shard file named
+      `<output_file>-<rank>-of-<num_shards>` (consumable downstream with a
+      glob pattern); with one shard, a single file is written at
+      `output_file`.
 
   Returns:
     The total number of tf.train.Example proto written to file.
   """
   tf.io.gfile.makedirs(os.path.dirname(output_file))
-  writer = tf.io.TFRecordWriter(output_file)
 
-  def count_labels(example):
-    return len(example.label_ids) - example.label_ids.count(_PADDING_LABEL_ID)
-
-  examples_n = []
+  # Count each example's real labels exactly once; the same count drives both
+  # the keep/drop filter and the sort key instead of rescanning label_ids.
+  keyed_examples = []
   for example in examples:
-    if count_labels(example) != 0:
-      examples_n.append(example)
+    num_real_labels = (
+        len(example.label_ids) - example.label_ids.count(_PADDING_LABEL_ID))
+    if num_real_labels:
+      keyed_examples.append((num_real_labels, example))
+  keyed_examples.sort(key=lambda keyed: keyed[0])
 
   #sort examples by label_ids
-  examples_s = sorted(examples_n, key=count_labels)
-
-  def perform_convert_to_features(example, tokenizer,max_seq_length,doc_stride):
-    if doc_stride:
-        tokenized_examples = convert_examples_to_features(example, tokenizer=tokenizer,max_seq_length=max_seq_length, doc_stride=doc_stride, is_training=is_training)
-    else:
-        tokenized_examples = _tokenize_example(example, max_seq_length, tokenizer,text_preprocessing, doc_stride=None)
-
-    tf_examples = []
-    for per_tokenized_example in tokenized_examples:
-      tf_example = _convert_single_example(per_tokenized_example,
-                                           max_seq_length, tokenizer)
-      tf_examples.append(tf_example)
-    return tf_examples
-
-  # n_jobs = mp.cpu_count() if doc_stride else 1
-  # tf_examples= Parallel(n_jobs=1, prefer="threads")(delayed(perform_convert_to_features)(example, tokenizer, max_seq_length, doc_stride) for example in examples_s[-31:-1])
-  # tf_examples = [item for sublist in tf_examples for item in sublist]
-  # num_tokenized_examples = len(tf_examples)
-
-  all_tf_examples = []
-  for example in examples_s:
-    tf_examples = perform_convert_to_features(example, tokenizer, max_seq_length, doc_stride)
-    all_tf_examples.extend(tf_examples)
-
-  num_tokenized_examples = len(all_tf_examples)
-  for tf_example in all_tf_examples:
-    writer.write(tf_example.SerializeToString())
-  writer.close()
+  examples_s = [example for _, example in keyed_examples]
+
+  if num_shards is None:
+    num_shards = mp.cpu_count()
+
+  initargs = (tokenizer, max_seq_length, doc_stride, text_preprocessing,
+              is_training)
+  if num_shards <= 1:
+    # Each example is independent, so fan the tokenization + conversion out
+    # to one worker per core and stream the already-serialized protos
+    # straight to the writer, keeping memory flat instead of O(corpus).
+    writer = tf.io.TFRecordWriter(output_file)
+    num_tokenized_examples = 0
+    with mp.Pool(
+        mp.cpu_count(), initializer=_init_worker, initargs=initargs) as pool:
+      for serialized in pool.imap_unordered(
+          _worker_convert, examples_s, chunksize=64):
+        for serialized_example in serialized:
+          writer.write(serialized_example)
+        num_tokenized_examples += len(serialized)
+    writer.close()
+  else:
+    # Sharded output: each worker owns one shard file, so conversion and
+    # writing both run in parallel with no contention on a single writer.
+    # Round-robin assignment over the length-sorted examples keeps the
+    # shards balanced.
+    shards = [
+        ("%s-%05d-of-%05d" % (output_file, rank, num_shards),
+         examples_s[rank::num_shards]) for rank in range(num_shards)
+    ]
+    with mp.Pool(
+        min(num_shards, mp.cpu_count()),
+        initializer=_init_worker, initargs=initargs) as pool:
+      num_tokenized_examples = sum(pool.imap_unordered(_write_shard, shards))
 
 
   # for (ex_index, example) in enumerate(examples):
@@ -684,10 +941,16 @@ def load_jsonl(input_path) -> list:
     """
     Read list of objects from a JSON lines file.
     """
-    data = []
-    with open(input_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data.append(json.loads(line.rstrip('\n|\r')))
+    if orjson is not None:
+        # Slurp the file as bytes in one read; orjson skips the per-line
+        # UTF-8 decode and trailing-whitespace handling entirely.
+        with open(input_path, 'rb') as f:
+            data = [orjson.loads(line) for line in f.read().splitlines()]
+    else:
+        data = []
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                data.append(json.loads(line.rstrip('\n|\r')))
     print('Loaded {} records from {}'.format(len(data), input_path))
     return data
 
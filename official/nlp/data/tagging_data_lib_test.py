@@ -104,6 +104,49 @@ class TaggingDataLibTest(tf.test.TestCase, parameterized.TestCase):
 
     self.assertCountEqual(files, expected_files)
 
+  def test_write_example_to_file_sharded(self):
+    processor = self.processors["panx"]()
+    input_data_dir = os.path.join(self.get_temp_dir(), "sharded")
+    tf.io.gfile.mkdir(input_data_dir)
+    _create_fake_file(
+        os.path.join(input_data_dir, "train-en.tsv"),
+        processor.get_labels(),
+        is_test=False)
+    examples = tagging_data_lib._read_one_file(
+        os.path.join(input_data_dir, "train-en.tsv"), processor.get_labels())
+    tokenizer = tokenization.FullTokenizer(
+        vocab_file=self.vocab_file, do_lower_case=True)
+
+    output_path = os.path.join(input_data_dir, "output")
+    unsharded_file = os.path.join(output_path, "train.tfrecord")
+    unsharded_size = tagging_data_lib.write_example_to_file(
+        examples,
+        tokenizer,
+        max_seq_length=8,
+        output_file=unsharded_file,
+        text_preprocessing=tokenization.convert_to_unicode)
+
+    num_shards = 2
+    sharded_file = os.path.join(output_path, "train_sharded.tfrecord")
+    sharded_size = tagging_data_lib.write_example_to_file(
+        examples,
+        tokenizer,
+        max_seq_length=8,
+        output_file=sharded_file,
+        text_preprocessing=tokenization.convert_to_unicode,
+        num_shards=num_shards)
+
+    self.assertEqual(sharded_size, unsharded_size)
+    shard_files = [
+        "%s-%05d-of-%05d" % (sharded_file, rank, num_shards)
+        for rank in range(num_shards)
+    ]
+    for shard_file in shard_files:
+      self.assertTrue(tf.io.gfile.exists(shard_file))
+    num_records = sum(
+        1 for _ in tf.data.TFRecordDataset(shard_files).as_numpy_iterator())
+    self.assertEqual(num_records, sharded_size)
+
 
 if __name__ == "__main__":
   tf.test.main()